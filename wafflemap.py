@@ -35,6 +35,8 @@ class Wafflemap:
         
         self.height = 5
         self.width = die_aspect_ratio * self.height
+        self.v_flip = v_flip
+        self.h_flip = h_flip
         
         # Default die parameters
         self.default_die_facecolor = 'gray'
@@ -118,20 +120,33 @@ class Wafflemap:
             print("No die list, setting default with dies_in_radius()")
             self.add_die_list(self.dies_in_radius())
         
-        if ax is None:
-            self.fig, self.ax = plt.subplots(1,1, **fig_kwargs)
-        else:
+        # without ax, the figure is only created when the wafermap is drawn
+        self._fig_kwargs = fig_kwargs
+        self._ax = None
+        if ax is not None:
             self.ax = ax
-            self.fig = ax.figure # parent figure of the passed ax
-            
-        self.ax.set_axis_off()
-        self.ax.tick_params(axis='both', which='both',
-                            length=0, width=0, labelsize=0)
-        self.ax.axis('equal')
-        self.ax.set_xlim([self.df.plotx.min(),
-                          self.df.plotx.max() + self.width])
-        self.ax.set_ylim([self.df.ploty.min(),
-                          self.df.ploty.max() + self.height])
+    
+    @property
+    def ax(self):
+        if self._ax is None:
+            fig, self.ax = plt.subplots(1,1, **self._fig_kwargs)
+        return self._ax
+    
+    @ax.setter
+    def ax(self, ax):
+        self._ax = ax
+        self._ax.set_axis_off()
+        self._ax.tick_params(axis='both', which='both',
+                             length=0, width=0, labelsize=0)
+        self._ax.axis('equal')
+        self._ax.set_xlim([self.df.plotx.min(),
+                           self.df.plotx.max() + self.width])
+        self._ax.set_ylim([self.df.ploty.min(),
+                           self.df.ploty.max() + self.height])
+    
+    @property
+    def fig(self):
+        return self.ax.figure # parent figure of the ax
             
 ##############################################################################
 ############################## Die management ################################
@@ -556,6 +571,16 @@ class Wafflemap:
             path = self.default_save_dir
             self.fig.savefig(os.path.join(path, file),format='png')
       
+    ### Comparison
+    def compare_to(self, reference, column, tolerance=0, ax=None):
+        """
+        Compare the values of a column of this wafermap against a reference
+        wafermap. Shortcut for compare_maps(self, column, reference, ...),
+        returns a new Wafflemap with the comparison columns.
+        """
+        return compare_maps(self, column, reference,
+                            tolerance=tolerance, ax=ax)
+        
     ### Others
     def is_rgba_array(self, array):
         if not isinstance(array, np.ndarray):
@@ -581,6 +606,185 @@ def tuple_list_2_XY_list(tuple_list):
     for (x,y) in tuple_list:
         res.append(f'X{x:d}Y{y:d}')            
     return res
+
+# columns of Wafflemap.df used to draw the dies
+_GRID_COLUMNS = ['x', 'y', 'plotx', 'ploty', 'color', 'edgecolor', 'hatch',
+                 'in_wafer', 'xy']
+
+def _die_values(wm, column):
+    """DataFrame with the x, y and column values of the dies in the wafer"""
+    assert column in wm.df.columns, "column not found in DataFrame"
+    assert column not in _GRID_COLUMNS, "cannot compare a column used to draw the dies"
+    df = wm.df.loc[wm.df.in_wafer == True, ['x', 'y', column]]
+    # object dtype keeps integer bins as integers when NaN are introduced
+    return df.astype({column: object})
+
+def _aggregate_values(wm_list, column, agg='mode'):
+    values = pd.concat([_die_values(wm, column) for wm in wm_list],
+                       ignore_index=True)
+    if agg == 'mode':
+        # most frequent value of each die (the smallest one in case of a tie)
+        counts = (values.dropna(subset=[column])
+                  .groupby(['x', 'y', column]).size().reset_index(name='count'))
+        counts = (counts.sort_values('count', ascending=False, kind='stable')
+                  .drop_duplicates(['x', 'y']))
+        res = values[['x', 'y']].drop_duplicates().merge(
+            counts[['x', 'y', column]], on=['x', 'y'], how='left')
+    else:
+        if agg in ['mean', 'median', 'min', 'max', 'std']:
+            numeric = pd.to_numeric(values[column], errors='coerce')
+            assert (numeric.notna() == values[column].notna()).all(), \
+                f"agg '{agg}' can only be used with a numerical column"
+            values[column] = numeric
+        res = values.groupby(['x', 'y'], as_index=False)[column].agg(agg)
+    return res.astype({column: object})
+
+def _format_value(value):
+    """String of a die value, without the '.0' of whole floats"""
+    if isinstance(value, (float, np.floating)) and float(value).is_integer():
+        return str(int(value))
+    return str(value)
+
+def _format_values(values):
+    """Array of strings of a column of die values, 'NA' for missing values"""
+    codes, uniques = pd.factorize(values) # missing values get code -1
+    labels = np.array([_format_value(u) for u in uniques] + ['NA'], dtype=object)
+    return labels[codes]
+
+def _union_ranges(wm_list):
+    x_range = [min(wm.x_range.min() for wm in wm_list),
+               max(wm.x_range.max() for wm in wm_list)]
+    y_range = [min(wm.y_range.min() for wm in wm_list),
+               max(wm.y_range.max() for wm in wm_list)]
+    return x_range, y_range
+
+def _new_map(wm, x_range, y_range, values, ax=None):
+    """
+    Create a Wafflemap with the coordinate system of wm, where the dies of
+    the wafer are the rows of values, and add the columns of values to its df
+    """
+    die_list = set(zip(values.x, values.y))
+    new_wm = Wafflemap(x_range, y_range, die_list=die_list,
+                       die_aspect_ratio=wm.width/wm.height,
+                       v_flip=wm.v_flip, h_flip=wm.h_flip, ax=ax)
+    new_wm.df = new_wm.df.merge(values, on=['x', 'y'], how='left')
+    return new_wm
+
+def aggregate_maps(wm_list, column, agg='mode', ax=None):
+    """
+    Create a reference wafermap whose column holds the die by die aggregate
+    of the column over all the wafermaps of the list.
+    - wm_list: list of Wafflemap objects
+    - column: name of the DataFrame column to aggregate
+    - agg: 'mode' (default) for the most frequent value of each die, or any
+           aggregation accepted by pandas groupby().agg() ('median', 'mean',
+           'max', 'first', a function...). 'median', 'mean', 'min', 'max'
+           and 'std' can only be used with numerical columns
+    - ax: matplotlib.axes.Axes object for the new wafermap
+    The dies of the reference are all the dies present in any of the wafermaps
+    """
+    values = _aggregate_values(wm_list, column, agg)
+    x_range, y_range = _union_ranges(wm_list)
+    return _new_map(wm_list[0], x_range, y_range, values, ax=ax)
+
+def compare_values(wm_list, column, reference=None, agg='mode', tolerance=0):
+    """
+    Compare die by die the values of a column of one or more wafermaps against
+    a reference wafermap, without creating any figure. All the wafermaps are
+    aligned on their die coordinates in a single join, so they can have
+    different x_range, y_range and die lists.
+    - wm_list: Wafflemap object or list of Wafflemap objects to compare
+    - column: name of the DataFrame column to compare
+    - reference: Wafflemap object to compare against. If None, the reference
+                 is the aggregate of wm_list (see aggregate_maps)
+    - agg: aggregation used to build the reference when reference is None
+           (most frequent value by default, see aggregate_maps)
+    - tolerance: numerical differences smaller or equal to tolerance are not
+                 considered as a change
+    Returns a DataFrame with one row per die present in either a wafermap or
+    the reference, and the following columns:
+    - 'wafer': position of the wafermap in wm_list
+    - 'x', 'y': die coordinates
+    - column: value of the wafermap (NaN if the die is not in the wafermap)
+    - column + '_ref': value of the reference (NaN if not in the reference)
+    - 'delta': value - reference value (NaN if not numerical)
+    - 'ratio': value / reference value (NaN if not numerical or divided by 0)
+    - 'bin_transition': string 'reference value->value', e.g. '1->7'
+    - 'changed': True if the value is different from the reference, or if the
+                 die is only in one of the two wafermaps
+    """
+    if isinstance(wm_list, Wafflemap):
+        wm_list = [wm_list]
+    ref_col = column + '_ref'
+    assert column not in ['wafer', ref_col, 'delta', 'ratio', 'bin_transition', 'changed'], \
+        "cannot compare a column named like a comparison column"
+    
+    if reference is None:
+        ref_values = _aggregate_values(wm_list, column, agg)
+    else:
+        ref_values = _die_values(reference, column)
+    ref_values = ref_values.rename(columns={column: ref_col})
+    
+    # one row per die of each wafer, joined with a copy of the reference per wafer
+    keys = list(range(len(wm_list)))
+    values = pd.concat([_die_values(wm, column) for wm in wm_list],
+                       keys=keys, names=['wafer', None]).reset_index('wafer')
+    ref_values = pd.concat([ref_values] * len(wm_list),
+                           keys=keys, names=['wafer', None]).reset_index('wafer')
+    df = values.merge(ref_values, on=['wafer', 'x', 'y'], how='outer',
+                      indicator=True)
+    
+    value = pd.to_numeric(df[column], errors='coerce')
+    ref_value = pd.to_numeric(df[ref_col], errors='coerce')
+    df['delta'] = value - ref_value
+    df['ratio'] = (value / ref_value).replace([np.inf, -np.inf], np.nan)
+    value_labels = _format_values(df[column])
+    ref_labels = _format_values(df[ref_col])
+    df['bin_transition'] = ref_labels + '->' + value_labels
+    in_wm = df._merge != 'right_only'
+    in_ref = df._merge != 'left_only'
+    differs = np.where(df.delta.notna(),
+                       df.delta.abs() > tolerance,
+                       value_labels != ref_labels)
+    df['changed'] = (in_wm != in_ref) | (in_wm & in_ref & differs)
+    return df.drop(columns='_merge')
+
+def compare_maps(wm_list, column, reference=None, agg='mode', tolerance=0,
+                 ax=None):
+    """
+    Same as compare_values, but returns a new Wafflemap (or a list of them if
+    a list was passed) covering the union of the coordinate ranges, whose dies
+    are the dies present in either the wafermap or the reference, and whose
+    df holds the comparison columns. 'changed' is False for the dies outside
+    of the wafer.
+    - ax: matplotlib.axes.Axes object (or list of them, one per wafermap)
+          for the new wafermaps. If None, the figure of each new wafermap is
+          only created when it is drawn
+    """
+    single = isinstance(wm_list, Wafflemap)
+    if single:
+        wm_list = [wm_list]
+    if ax is None:
+        ax = [None] * len(wm_list)
+    elif not isinstance(ax, (list, tuple, np.ndarray)):
+        ax = [ax]
+    assert len(ax) == len(wm_list), "there must be one ax per wafermap"
+    
+    df = compare_values(wm_list, column, reference, agg, tolerance)
+    if reference is None:
+        x_range, y_range = _union_ranges(wm_list)
+    else:
+        x_range, y_range = _union_ranges(wm_list + [reference])
+    
+    res = []
+    grouped = dict(list(df.groupby('wafer')))
+    for i, wm in enumerate(wm_list):
+        wafer_df = grouped.get(i, df.iloc[:0]).drop(columns='wafer')
+        new_wm = _new_map(wm, x_range, y_range, wafer_df, ax=ax[i])
+        new_wm.df['changed'] = new_wm.df.changed.eq(True)
+        res.append(new_wm)
+    
+    return res[0] if single else res
         
 # tests for when you run this script instead of importing it
 if __name__ == "__main__":
@@ -589,4 +793,51 @@ if __name__ == "__main__":
     wm1.plot_dies()
     wm1.plot_wafer_outline()
     wm1.label_all_dies()
-    wm1.save_png()
\ No newline at end of file
+    wm1.save_png()
+    
+    # Comparison of wafermaps with different ranges and die lists
+    pre = Wafflemap([0,2], [0,1], die_list=[(0,0), (0,1), (1,0), (1,1)])
+    post = Wafflemap([1,3], [0,1], die_list=[(1,0), (1,1), (2,0), (2,1)])
+    pre.df['value'] = [0.0 if (x,y) == (1,1) else 2.0 for (x,y) in pre.df.xy]
+    post.df['value'] = [1.0 if (x,y) == (1,1) else 2.05 for (x,y) in post.df.xy]
+    diff = post.compare_to(pre, 'value', tolerance=0.1)
+    assert list(diff.x_range) == [0,3] and list(diff.y_range) == [0,1]
+    assert diff.df.changed.dtype == bool
+    assert diff.df.in_wafer.sum() == 6 # dies of both wafermaps
+    assert diff.get_value(0,0,'changed') and diff.get_value(0,0,'bin_transition') == '2->NA'
+    assert diff.get_value(2,0,'changed') and diff.get_value(2,0,'bin_transition') == 'NA->2.05'
+    assert not diff.get_value(1,0,'changed') # within tolerance
+    assert post.compare_to(pre, 'value').get_value(1,0,'changed')
+    assert diff.get_value(1,1,'changed') and diff.get_value(1,1,'delta') == 1
+    assert np.isnan(diff.get_value(1,1,'ratio')) # divided by 0
+    assert not diff.get_value(3,0,'changed') # not in any wafer
+    
+    # Non-numerical column
+    pre.df['bin'] = 'pass'
+    post.df['bin'] = ['fail' if (x,y) == (2,1) else 'pass' for (x,y) in post.df.xy]
+    diff = post.compare_to(pre, 'bin')
+    assert not diff.get_value(1,0,'changed') and diff.get_value(1,0,'bin_transition') == 'pass->pass'
+    assert np.isnan(diff.get_value(1,0,'delta'))
+    assert diff.get_value(2,1,'changed')
+    df = compare_values([pre, post], 'bin') # most frequent value as reference
+    assert set(df.bin_transition) == {'pass->pass', 'pass->NA', 'fail->NA', 'fail->fail'}
+    try:
+        compare_values([pre, post], 'bin', agg='median')
+        assert False, "median of a non-numerical column must fail"
+    except AssertionError as e:
+        assert 'numerical' in str(e)
+    
+    # Lot compared against its aggregated reference (most frequent bin)
+    lot = [Wafflemap([0,1], [0,1], die_list={(0,0), (0,1), (1,0), (1,1)})
+           for i in range(4)]
+    for wm, b in zip(lot, [1, 1, 7, 7]):
+        wm.df['bin'] = b
+    lot_diff = compare_maps(lot, 'bin')
+    assert len(lot_diff) == 4 and all(d._ax is None for d in lot_diff) # no figure yet
+    assert all(d.df.changed.dtype == bool for d in lot_diff)
+    assert set(lot_diff[0].df[lot_diff[0].df.in_wafer].bin_transition) == {'1->1'}
+    assert lot_diff[2].df[lot_diff[2].df.in_wafer].changed.all()
+    assert set(lot_diff[2].df[lot_diff[2].df.in_wafer].bin_transition) == {'1->7'}
+    df = compare_values(lot[1:], 'bin', agg='median')
+    assert set(df.bin_transition) == {'7->1', '7->7'}
+    print("comparison checks passed")
\ No newline at end of file
@@ -65,5 +65,23 @@ wm3.plot_wafer_outline(18, y_offset=-1, notch='S', notch_type='f', notch_size=3,
 wm3.label_all_dies(column='Voltage', fontsize=7)
 print(wm3.get_die_list())
 ###############################################################################
-plt.tight_layout()
+
+# Comparison of two wafermaps with different ranges and die lists
+print("comparison")
+fig2, axes2 = plt.subplots(1,3, figsize=(10,5))
+wm_pre = wafflemap.Wafflemap([-3,3],[-3,3], ax=axes2[0])
+wm_pre.df["bin"] = 1
+wm_post = wafflemap.Wafflemap([-2,4],[-3,3], ax=axes2[1])
+wm_post.df["bin"] = [7 if x == y else 1 for (x,y) in wm_post.df.xy]
+for wm in [wm_pre, wm_post]:
+    wm.plot_dies()
+    wm.label_all_dies(column='bin')
+wm_diff = wm_post.compare_to(wm_pre, 'bin', ax=axes2[2])
+wm_diff.colorfill_die_list(wm_diff.df[wm_diff.df.changed].xy, 'red')
+wm_diff.plot_dies()
+wm_diff.label_all_dies(column='bin_transition', fontsize=3)
+print(wm_diff.df[wm_diff.df.changed][['x','y','bin_transition']])
+###############################################################################
+fig.tight_layout()
+fig2.tight_layout()
 plt.show()
\ No newline at end of file